@@ -0,0 +1,29 @@
+"""prompt_toolkit controls; imported only once the UI is built."""
+
+from typing import Callable, List, Optional
+
+from prompt_toolkit.formatted_text import StyleAndTextTuples
+from prompt_toolkit.formatted_text.utils import split_lines
+from prompt_toolkit.layout.controls import UIContent, UIControl
+
+
+class WindowedListControl(UIControl):
+    """Focusable control whose fragments are built for the height being drawn.
+
+    FormattedTextControl fetches its text once per render, before the window
+    height is known, so a list that only renders the visible rows would be
+    sized for the previous frame. Here get_fragments receives the height
+    passed to create_content (None when it is not known).
+    """
+
+    def __init__(
+        self, get_fragments: Callable[[Optional[int]], StyleAndTextTuples]
+    ) -> None:
+        self.get_fragments = get_fragments
+
+    def is_focusable(self) -> bool:
+        return True
+
+    def create_content(self, width: int, height: Optional[int]) -> UIContent:
+        lines: List[StyleAndTextTuples] = list(split_lines(self.get_fragments(height)))
+        return UIContent(get_line=lambda i: lines[i], line_count=len(lines))
@@ -1,73 +1,122 @@
+from __future__ import annotations
+
 import asyncio
 import argparse
 import os
+import shutil
 import subprocess
 import sys
-from datetime import datetime
+import time
+from collections import deque
 from pathlib import Path
-from typing import Callable, List, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, Deque, List, Optional, TextIO, Tuple
+
+from _fastpath import (
+    BRANCH_FORMAT,
+    BRANCH_STYLES,
+    Branch,
+    Row,
+    build_rows,
+    parse_branches,
+    render_rows,
+)
+
+# prompt_toolkit is imported where the UI is built, so --help and the
+# not-a-repo bail-out don't pay for loading it.
+if TYPE_CHECKING:
+    from prompt_toolkit.formatted_text import StyleAndTextTuples
+    from prompt_toolkit.key_binding import KeyBindings
+
+
+LOG_MAX_LINES = 2000  # lines kept in the on-screen log
+LOG_MAX_CHARS = 256 * 1024  # characters kept in the on-screen log
+LOG_FLUSH_DELAY = 0.05  # seconds to batch log lines before redrawing
+READ_CHUNK_SIZE = 4096  # bytes read from git's output per await
+LIST_FRAME_HEIGHT = 20  # max height of the branches frame, border included
 
-from prompt_toolkit import Application
-from prompt_toolkit.application.current import get_app
-from prompt_toolkit.filters import Condition
-from prompt_toolkit.formatted_text import FormattedText
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.layout import HSplit, Layout, Window
-from prompt_toolkit.layout.controls import FormattedTextControl
-from prompt_toolkit.layout.dimension import D
-from prompt_toolkit.styles import Style
-from prompt_toolkit.widgets import Frame, TextArea
+# Resolved once so spawning git doesn't search PATH every time. Commands keep
+# "git" as argv[0] for display; this is passed as the executable.
+GIT_EXECUTABLE = shutil.which("git") or "git"
 
+# Env for the read-only plumbing we parse: the C locale skips git's locale
+# setup, and no optional locks means these calls never take .git/index.lock.
+# Interactive commands keep the user's env so their messages stay translated.
+GIT_PLUMBING_ENV = {**os.environ, "GIT_OPTIONAL_LOCKS": "0", "LC_ALL": "C"}
 
-Branch = Tuple[str, bool]  # (branch name, is_current)
+LOG_DIR = str(Path.home() / ".lazygit_logging")
+LOG_PATH = os.path.join(LOG_DIR, "branch_selector.log")
+_log_dir_ready = False  # set once LOG_DIR has been created this process
 
 
 def run_git_output(args: List[str], cwd: str) -> Tuple[int, str]:
     """Run a git command and capture its output."""
     proc = subprocess.run(
-        args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        args,
+        executable=GIT_EXECUTABLE,
+        cwd=cwd,
+        env=GIT_PLUMBING_ENV,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
     )
-    return proc.returncode, proc.stdout
+    return proc.returncode, proc.stdout.decode("utf-8", "replace")
 
 
 def list_branches(repo_path: str) -> List[Branch]:
-    """Return a list of (branch, is_current) tuples."""
-    code, current = run_git_output(
-        ["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=repo_path
-    )
-    current = current.strip() if code == 0 else ""
-
+    """Return the local branches with their upstream and tip commit details."""
     code, output = run_git_output(
-        ["git", "for-each-ref", "refs/heads", "--format=%(refname:short)"],
+        ["git", "for-each-ref", "refs/heads", f"--format={BRANCH_FORMAT}"],
         cwd=repo_path,
     )
     if code != 0:
         raise RuntimeError(output)
 
-    branches: List[Branch] = []
-    for line in output.splitlines():
-        name = line.strip()
-        if not name:
-            continue
-        branches.append((name, name == current))
-    return branches
+    return parse_branches(output)
 
 
 class BranchSelectorUI:
     def __init__(self, repo_path: str, quit_on_switch: bool = True) -> None:
+        from prompt_toolkit import Application
+        from prompt_toolkit.filters import Condition
+        from prompt_toolkit.key_binding import KeyBindings
+        from prompt_toolkit.layout import HSplit, Layout, Window
+        from prompt_toolkit.layout.controls import FormattedTextControl
+        from prompt_toolkit.layout.dimension import D
+        from prompt_toolkit.styles import Style
+        from prompt_toolkit.widgets import Frame, TextArea
+
+        from _widgets import WindowedListControl
+
         self.repo_path = repo_path
         self.quit_on_switch = quit_on_switch
-        self.log_dir = Path.home() / ".lazygit_logging"
-        self.log_dir.mkdir(exist_ok=True, parents=True)
-        self.log_file = self.log_dir / "branch_selector.log"
+        global _log_dir_ready
+        if not _log_dir_ready:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            _log_dir_ready = True
+        self.log_file = LOG_PATH
+        self._log_fh: Optional[TextIO] = None
+        try:
+            # Line buffered so entries still hit disk promptly.
+            self._log_fh = open(self.log_file, "a", encoding="utf-8", buffering=1)
+        except OSError:
+            pass
         self.branches: List[Branch] = list_branches(repo_path)
+        # Formatted rows for self.branches; rebuilt when branches change.
+        self._rendered: Optional[List[Row]] = None
         self.selected: int = 0
+        self._scroll: int = 0  # index of the first branch rendered
         self.processing: bool = False
         self.proc: Optional[asyncio.subprocess.Process] = None
         self.status: str = (
             "↑/↓ to move • Enter to switch • Delete to delete • Ctrl-C/Esc to quit"
         )
         self.awaiting_force_branch: Optional[str] = None
+        self._log_lines: Deque[str] = deque()
+        self._log_chars = 0  # len("\n".join(self._log_lines)) + 1
+        self._log_flush_scheduled = False
+        self._invalidate_scheduled = False
+        # Lines not yet in the log file, and when the first of them arrived.
+        self._log_pending: List[str] = []
+        self._log_pending_since = 0.0
 
         self.log_area = TextArea(
             text="",
@@ -83,9 +132,7 @@ class BranchSelectorUI:
             style="class:input",
         )
 
-        self.list_control = FormattedTextControl(
-            self._render_branch_list, focusable=True
-        )
+        self.list_control = WindowedListControl(self._render_branch_list)
         self.list_window = Window(
             content=self.list_control,
             always_hide_cursor=True,
@@ -97,7 +144,7 @@ class BranchSelectorUI:
                 Frame(
                     self.list_window,
                     title="Branches",
-                    height=D(preferred=20, max=20),
+                    height=D(preferred=LIST_FRAME_HEIGHT, max=LIST_FRAME_HEIGHT),
                 ),
                 Frame(
                     HSplit(
@@ -136,26 +183,36 @@ class BranchSelectorUI:
             layout=Layout(body, focused_element=self.list_window),
             key_bindings=kb,
             full_screen=True,
-            mouse_support=True,
+            # Mouse tracking is dropped while git streams output, so the
+            # renderer isn't also parsing mouse reports during those redraws.
+            mouse_support=Condition(lambda: not self.processing),
             style=self.style,
         )
 
-    def _render_branch_list(self) -> FormattedText:
-        lines: FormattedText = []
+    def _render_branch_list(self, height: Optional[int]) -> StyleAndTextTuples:
         if not self.branches:
-            return [("class:branch", "No branches found\n")]
-
-        for idx, (name, is_current) in enumerate(self.branches):
-            style_parts = ["class:branch"]
-            if is_current:
-                style_parts.append("class:branch.current")
-            if idx == self.selected:
-                style_parts.append("class:branch.selected")
-            prefix = "* " if is_current else "  "
-            lines.append((" ".join(style_parts), f"{prefix}{name}\n"))
-        return lines
+            return [(BRANCH_STYLES[False, False], "No branches found\n")]
+
+        if self._rendered is None:
+            self._rendered = build_rows(self.branches)
+
+        # Only hand prompt_toolkit the rows that fit in the height being
+        # drawn, scrolled to keep the selection in view.
+        if height is None:
+            height = LIST_FRAME_HEIGHT - 2
+        if self.selected < self._scroll:
+            self._scroll = self.selected
+        elif self.selected >= self._scroll + height:
+            self._scroll = self.selected - height + 1
+        self._scroll = max(0, min(self._scroll, len(self._rendered) - height))
+        return render_rows(
+            self._rendered, self.selected, self._scroll, self._scroll + height
+        )
 
     def _register_keys(self, kb: KeyBindings) -> None:
+        from prompt_toolkit.application.current import get_app
+        from prompt_toolkit.filters import Condition
+
         is_input_focused = Condition(
             lambda: get_app().layout.has_focus(self.input_area)
         )
@@ -184,22 +241,24 @@ class BranchSelectorUI:
         def _(event) -> None:
             if self.processing or not self.branches:
                 return
-            branch = self.branches[self.selected][0]
+            branch = self.branches[self.selected].name
             self._run_git(
                 ["git", "switch", branch],
-                on_success=event.app.exit if self.quit_on_switch else self._after_switch,
-                refresh=not self.quit_on_switch,
+                on_success=(
+                    event.app.exit
+                    if self.quit_on_switch
+                    else lambda: self._after_switch(branch)
+                ),
             )
 
         @kb.add("delete", filter=~is_input_focused)
         def _(event) -> None:
             if self.processing or not self.branches:
                 return
-            branch = self.branches[self.selected][0]
+            branch = self.branches[self.selected].name
             self._run_git(
                 ["git", "branch", "-d", branch],
                 on_success=self._refresh_branches,
-                refresh=True,
                 on_failure=lambda: self._start_force_prompt(branch),
             )
 
@@ -222,7 +281,6 @@ class BranchSelectorUI:
             self._run_git(
                 ["git", "branch", "-D", branch],
                 on_success=self._refresh_branches,
-                refresh=True,
             )
 
         @kb.add("n", filter=is_force_prompt)
@@ -234,20 +292,36 @@ class BranchSelectorUI:
             self.status = (
                 "Force delete canceled. ↑/↓ to move • Enter to switch • Delete to delete"
             )
+            self._invalidate()
+
+    def _invalidate(self) -> None:
+        """Request a redraw; calls within one loop tick share a single one."""
+        if self._invalidate_scheduled:
+            return
+        loop = self.app.loop
+        if loop is None:
             self.app.invalidate()
+            return
+        self._invalidate_scheduled = True
+        loop.call_soon(self._do_invalidate)
+
+    def _do_invalidate(self) -> None:
+        self._invalidate_scheduled = False
+        self.app.invalidate()
 
     def _refresh_branches(self) -> None:
-        old_name = self.branches[self.selected][0] if self.branches else None
+        old_name = self.branches[self.selected].name if self.branches else None
         try:
             self.branches = list_branches(self.repo_path)
         except Exception as exc:  # noqa: BLE001
             self._append_log(f"[error] {exc}")
             return
+        self._rendered = None
 
         self.selected = 0
         if old_name:
-            for idx, (name, _) in enumerate(self.branches):
-                if name == old_name:
+            for idx, branch in enumerate(self.branches):
+                if branch.name == old_name:
                     self.selected = idx
                     break
 
@@ -255,33 +329,69 @@ class BranchSelectorUI:
         self._append_log_sync(line)
 
     def _append_log_sync(self, line: str) -> None:
-        if self.log_area.text:
-            self.log_area.text += "\n"
-        self.log_area.text += line
+        self._show_log_line(line)
+        if not self._log_pending:
+            self._log_pending_since = time.time()
+        self._log_pending.append(line)
+        if self._log_flush_scheduled:
+            return
+        loop = self.app.loop
+        if loop is None:
+            self._flush_log()
+            return
+        self._log_flush_scheduled = True
+        loop.call_later(LOG_FLUSH_DELAY, self._flush_log)
+
+    def _show_log_line(self, line: str) -> None:
+        """Add line to the on-screen log, dropping the oldest lines over budget."""
+        line = line[-LOG_MAX_CHARS:]
+        self._log_lines.append(line)
+        self._log_chars += len(line) + 1
+        while len(self._log_lines) > LOG_MAX_LINES or (
+            self._log_chars > LOG_MAX_CHARS and len(self._log_lines) > 1
+        ):
+            self._log_chars -= len(self._log_lines.popleft()) + 1
+
+    def _flush_log(self) -> None:
+        """Rebuild the log area from the buffered lines in one assignment."""
+        self._log_flush_scheduled = False
+        self._write_log_file()
+        self.log_area.text = "\n".join(self._log_lines)
         self.log_area.buffer.cursor_position = len(self.log_area.text)
-        self._write_log_file(line)
+        self._invalidate()
+
+    def _write_log_file(self) -> None:
+        """Write pending lines, all stamped with the time the batch started."""
+        pending, self._log_pending = self._log_pending, []
+        if self._log_fh is None or not pending:
+            return
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._log_pending_since))
+        try:
+            self._log_fh.write("".join(f"[{ts}] {line}\n" for line in pending))
+        except Exception:
+            # Avoid breaking the UI due to logging errors; stop trying after that.
+            self._log_fh = None
 
-    def _write_log_file(self, line: str) -> None:
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        entry = f"[{ts}] {line}\n"
+    def _close_log_file(self) -> None:
+        self._write_log_file()
+        if self._log_fh is None:
+            return
         try:
-            with self.log_file.open("a", encoding="utf-8") as fh:
-                fh.write(entry)
+            self._log_fh.close()
         except Exception:
-            # Avoid breaking the UI due to logging errors.
             pass
+        self._log_fh = None
 
     def _run_git(
         self,
         args: List[str],
         on_success: Optional[Callable[[], None]] = None,
         on_failure: Optional[Callable[[], None]] = None,
-        refresh: bool = False,
     ) -> None:
         self.processing = True
         self.status = f"Running: {' '.join(args)}"
         self._append_log(f"$ {' '.join(args)}")
-        self.app.invalidate()
+        self._invalidate()
 
         self.app.layout.focus(self.input_area)
         self.app.create_background_task(
@@ -289,7 +399,6 @@ class BranchSelectorUI:
                 args,
                 on_success=on_success,
                 on_failure=on_failure,
-                refresh=refresh,
             )
         )
 
@@ -298,34 +407,39 @@ class BranchSelectorUI:
         args: List[str],
         on_success: Optional[Callable[[], None]] = None,
         on_failure: Optional[Callable[[], None]] = None,
-        refresh: bool = False,
     ) -> None:
         proc = await asyncio.create_subprocess_exec(
             *args,
+            executable=GIT_EXECUTABLE,
             cwd=self.repo_path,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.STDOUT,
+            # Our own fds are all non-inheritable, so skip the close-all loop.
+            close_fds=False,
         )
         self.proc = proc
 
         assert proc.stdout is not None
+        # Read whatever is available and split lines ourselves; redraws are
+        # batched by _append_log, so there's no need to invalidate per line.
+        buf = bytearray()
         while True:
-            line = await proc.stdout.readline()
-            if not line:
+            chunk = await proc.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
                 break
-            if isinstance(line, bytes):
-                line = line.decode(errors="replace")
-            self._append_log(line.rstrip("\n"))
-            self.app.invalidate()
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                self._append_log(line.decode(errors="replace"))
+        if buf:
+            self._append_log(buf.decode(errors="replace"))
 
         code = await proc.wait()
         self.processing = False
         self.proc = None
 
         if code == 0:
-            if refresh:
-                self._refresh_branches()
             if on_success:
                 on_success()
             else:
@@ -339,13 +453,22 @@ class BranchSelectorUI:
             self.app.layout.focus(self.list_window)
         except Exception:
             pass
-        self.app.invalidate()
+        self._invalidate()
+
+    def _mutate_current_local(self, new_current: str) -> None:
+        """Mark new_current as checked out without asking git again."""
+        self.branches = [
+            branch._replace(is_current=branch.name == new_current)
+            for branch in self.branches
+        ]
+        self._rendered = None
 
-    def _after_switch(self) -> None:
+    def _after_switch(self, branch: str) -> None:
         """Update UI after successful switch when keeping the app open."""
-        self._refresh_branches()
+        # A switch only moves HEAD, so the branch set is unchanged.
+        self._mutate_current_local(branch)
         self.status = "Switched. ↑/↓ to move • Enter to switch • Delete to delete"
-        self.app.invalidate()
+        self._invalidate()
 
     async def _send_to_proc(self, text: str) -> None:
         if not self.processing or not self.proc or self.proc.stdin is None:
@@ -361,13 +484,16 @@ class BranchSelectorUI:
         """Enter force-delete prompt mode."""
         self.awaiting_force_branch = branch
         self.status = f"Delete failed. FORCE delete {branch}? y/N"
-        self.app.invalidate()
+        self._invalidate()
 
     def run(self) -> None:
-        if not self.branches:
-            print("No branches found.")
-            return
-        self.app.run()
+        try:
+            if not self.branches:
+                print("No branches found.")
+                return
+            self.app.run()
+        finally:
+            self._close_log_file()
 
 
 def ensure_repo(path: str) -> None:
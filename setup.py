@@ -0,0 +1,6 @@
+"""Compile _fastpath.py with mypyc: python setup.py build_ext --inplace"""
+
+from mypyc.build import mypycify
+from setuptools import setup
+
+setup(name="dirtygit-fastpath", ext_modules=mypycify(["_fastpath.py"]))